@@ -0,0 +1,599 @@
+"""NSO Wrangler API Program.
+Copyright (c) 2020 Cisco and/or its affiliates.
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+               https://developer.cisco.com/docs/licenses
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+"""
+
+__author__ = "Drew Taylor"
+__email__ = "dretaylo@cisco.com"
+__version__ = "0.1.1"
+__copyright__ = "Copyright (c) 2020 Cisco and/or its affiliates."
+__license__ = "Cisco Sample Code License, Version 1.1"
+
+
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import csv
+import glob
+import json
+import os
+import re
+import sys
+import zlib
+
+from nso_wrangler import NSOGovernor, NSOWrangler, SweepJournal, isSuccess
+from nso_router import NSORouter
+from poller.poller import Poller
+from split_tunnel_manager.split_tunnel_manager import SplitTunnelManager
+
+
+# Class and master function behind each command.
+COMMANDS = {
+    "poll": (Poller, "pullAllDeviceSessionData"),
+    "clear": (Poller, "clearAllDeviceSessionData"),
+    "kick": (Poller, "logoffAllUsersAllDevices"),
+    "audit": (SplitTunnelManager, "auditDevices"),
+    "update": (SplitTunnelManager, "updateDevices"),
+    "clear-split": (SplitTunnelManager, "clearDevices"),
+}
+
+# Commands that change devices, their failures set the exit status.
+WRITE_COMMANDS = ("clear", "kick", "update", "clear-split")
+
+
+def readList(filename):
+    """
+        Reads a list of devices or domains from a file, one per line.
+        Blank lines and lines starting with "#" are skipped.
+
+        :param filename: path of the file
+        :type filename: str
+
+        :return: entries of the file
+        :rtype: list[str]
+    """
+
+    with open(filename) as list_file:
+        return [line.strip() for line in list_file if line.strip() and not line.strip().startswith("#")]
+
+
+def splitList(value):
+    """
+        Splits a comma separated flag into a list.
+
+        :param value: comma separated entries
+        :type value: str
+
+        :return: entries of the flag
+        :rtype: list[str]
+    """
+
+    return [entry.strip() for entry in value.split(",") if entry.strip()]
+
+
+def loadSettings(options):
+    """
+        Builds the NSO settings from a JSON config file, overridden by flags.
+        The password falls back to the NSO_PASSWORD environment variable.
+        A config with "nodes" (and optionally "device_map") routes across several NSO servers.
+
+        :param options: parsed command line
+        :type options: argparse.Namespace
+
+        :return: NSO settings
+        :rtype: dict
+    """
+
+    settings = {}
+
+    if options.config:
+        with open(options.config) as config_file:
+            settings = json.load(config_file)
+
+    for key in ("nso_server", "nso_port", "username", "password"):
+        if getattr(options, key):
+            settings[key] = getattr(options, key)
+
+    if "password" not in settings and os.environ.get("NSO_PASSWORD"):
+        settings["password"] = os.environ["NSO_PASSWORD"]
+
+    return settings
+
+
+def shardGovernor(processes):
+    """
+        Creates a governor with an even share of the default limits for one of several shards,
+        so the shards together put no more load on an NSO server than one process would.
+
+        :param processes: number of shards
+        :type processes: int
+
+        :return: governor for one shard
+        :rtype: NSOGovernor
+    """
+
+    limits = NSOGovernor()
+
+    return NSOGovernor(
+        rate=limits.rate / processes if limits.rate else None,
+        max_concurrency=max(1, limits.max_concurrency // processes),
+        initial_concurrency=max(1, int(limits.concurrency) // processes)
+    )
+
+
+def createClient(settings, wrangler_class, options, processes=1):
+    """
+        Creates the client for one NSO server, or a router for several.
+        When sharding, each NSO server gets a governor with its share of the limits.
+
+        :param settings: NSO settings
+        :type settings: dict
+        :param wrangler_class: NSOWrangler or a subclass
+        :type wrangler_class: type
+        :param options: parsed command line
+        :type options: argparse.Namespace
+        :param processes: number of shards the devices are split across
+        :type processes: int
+
+        :return: client the command runs on
+        :rtype: NSOWrangler or NSORouter
+    """
+
+    kwargs = { "transport": options.transport, "parse_workers": options.parse_workers }
+
+    if "nodes" in settings:
+        nodes = settings["nodes"]
+        if processes > 1:
+            nodes = {node: { **node_settings, "governor": shardGovernor(processes) } for node, node_settings in nodes.items()}
+        return NSORouter(nodes, device_map=settings.get("device_map"), wrangler_class=wrangler_class, **kwargs)
+
+    if processes > 1:
+        kwargs["governor"] = shardGovernor(processes)
+
+    return wrangler_class(
+        nso_server=settings["nso_server"],
+        nso_port=settings["nso_port"],
+        username=settings["username"],
+        password=settings["password"],
+        **kwargs
+    )
+
+
+def loadDevices(settings, options):
+    """
+        Collects the devices from flags, a devices file, or discovery on NSO.
+
+        :param settings: NSO settings, the device map is filled in when routing across NSO servers
+        :type settings: dict
+        :param options: parsed command line
+        :type options: argparse.Namespace
+
+        :return: hostnames of devices
+        :rtype: list[str]
+    """
+
+    devices = []
+
+    if options.devices:
+        devices += splitList(options.devices)
+    if options.devices_file:
+        devices += readList(options.devices_file)
+
+    if options.discover:
+        client = createClient(settings, NSOWrangler, options)
+        try:
+            devices += client.discoverDevices(
+                device_group=options.device_group,
+                ned_id=options.ned_id,
+                cache_file=options.inventory_cache
+            )
+            if isinstance(client, NSORouter):
+                settings["device_map"] = client.device_map
+        finally:
+            client.close()
+
+    return list(dict.fromkeys(devices))
+
+
+def commandArguments(options):
+    """
+        Builds the arguments of the master function behind the command.
+
+        :param options: parsed command line
+        :type options: argparse.Namespace
+
+        :return: arguments after the devices and keyword arguments
+        :rtype: tuple(list, dict)
+    """
+
+    if options.command in ("poll", "clear", "kick"):
+        return [], {}
+
+    if options.command == "clear-split":
+        args = [options.group_policy]
+    else:
+        exclude_domains = splitList(options.exclude_domains) if options.exclude_domains else []
+        include_domains = splitList(options.include_domains) if options.include_domains else []
+        if options.exclude_domains_file:
+            exclude_domains += readList(options.exclude_domains_file)
+        if options.include_domains_file:
+            include_domains += readList(options.include_domains_file)
+        args = [options.group_policy, exclude_domains, include_domains]
+
+    if options.command == "audit" and options.from_cdb:
+        return args, {}
+
+    kwargs = { "journal": options.journal, "resume": options.resume }
+
+    if options.command in ("update", "clear-split") and options.waves:
+        kwargs.update({
+            "waves": [int(size) for size in splitList(options.waves)],
+            "failure_threshold": options.failure_threshold,
+            "verify": options.verify
+        })
+
+    return args, kwargs
+
+
+def runShard(settings, options, devices, shard=None, processes=1):
+    """
+        Runs the command on a shard of the devices, in a worker process when sharding.
+        Each shard keeps its own journal, suffixed with the shard number.
+
+        :param settings: NSO settings
+        :type settings: dict
+        :param options: parsed command line
+        :type options: argparse.Namespace
+        :param devices: hostnames of devices in the shard
+        :type devices: list[str]
+        :param shard: number of the shard, None when not sharding
+        :type shard: int
+        :param processes: number of shards
+        :type processes: int
+
+        :return: result of the command for each device
+        :rtype: dict[str] = any
+    """
+
+    wrangler_class, method = COMMANDS[options.command]
+    args, kwargs = commandArguments(options)
+
+    if shard is not None and kwargs.get("journal"):
+        kwargs["journal"] = f"{kwargs['journal']}.{shard}"
+    if options.command == "audit" and options.from_cdb:
+        method = "auditDevicesFromCDB"
+
+    client = createClient(settings, wrangler_class, options, processes)
+
+    try:
+        return getattr(client, method)(devices, *args, **kwargs)
+    finally:
+        client.close()
+
+
+def shardJournal(settings, journal, device, shard=None):
+    """
+        Names the journal a device is checkpointed in.
+        Journals are suffixed with the shard number when sharding, and the NSO node when routing.
+
+        :param settings: NSO settings
+        :type settings: dict
+        :param journal: journal filename given on the command line
+        :type journal: str
+        :param device: hostname of device
+        :type device: str
+        :param shard: number of the shard, None when not sharding
+        :type shard: int
+
+        :return: journal filename, None if no NSO node manages the device
+        :rtype: str
+    """
+
+    filename = journal if shard is None else f"{journal}.{shard}"
+
+    if "nodes" in settings:
+        node = settings.get("device_map", {}).get(device)
+        return f"{filename}.{node}" if node else None
+
+    return filename
+
+
+def journalFiles(settings, journal):
+    """
+        Finds the journal and the shard and node journals left by previous runs.
+
+        :param settings: NSO settings
+        :type settings: dict
+        :param journal: journal filename given on the command line
+        :type journal: str
+
+        :return: filenames of the journals
+        :rtype: list[str]
+    """
+
+    nodes = "|".join(re.escape(node) for node in settings.get("nodes", {}))
+    suffix = re.compile(rf"(\.\d+)?(\.({nodes}))?" if nodes else r"(\.\d+)?")
+    filenames = [journal, *glob.glob(f"{glob.escape(journal)}.*")]
+
+    return [filename for filename in filenames if os.path.isfile(filename) and suffix.fullmatch(filename[len(journal):])]
+
+
+def clearJournals(settings, journal):
+    """
+        Removes the journals of previous runs before a fresh run, so a later resume
+        can't mistake journals this run doesn't write for its history.
+
+        :param settings: NSO settings
+        :type settings: dict
+        :param journal: journal filename given on the command line
+        :type journal: str
+    """
+
+    for filename in journalFiles(settings, journal):
+        os.remove(filename)
+
+
+def splitJournals(settings, journal, shards):
+    """
+        Hands the devices finished by a previous run to the journals this run resumes from.
+        Every journal of the previous run is read, oldest first, so a sweep can be resumed
+        with a different number of processes or NSO nodes. Journals this run doesn't use are removed.
+
+        :param settings: NSO settings
+        :type settings: dict
+        :param journal: journal filename given on the command line
+        :type journal: str
+        :param shards: hostnames of devices in each shard, keyed by shard number or None when not sharding
+        :type shards: dict[int] = list[str]
+    """
+
+    filenames = journalFiles(settings, journal)
+    entries = {}
+
+    for filename in sorted(filenames, key=os.path.getmtime):
+        entries.update(SweepJournal(filename).load())
+
+    journals = {}
+    for shard, devices in shards.items():
+        for device in devices:
+            filename = shardJournal(settings, journal, device, shard)
+            if filename:
+                journals.setdefault(filename, []).append(device)
+
+    for filename, devices in journals.items():
+        shard_journal = SweepJournal(filename)
+        shard_journal.reset()
+        for device in devices:
+            entry = entries.get(device)
+            if entry and entry["status"] == "ok":
+                shard_journal.record(device, True, entry["result"])
+
+    for filename in filenames:
+        if filename not in journals:
+            os.remove(filename)
+
+
+def runCommand(settings, options, devices):
+    """
+        Runs the command on every device, sharded across worker processes if asked.
+        Devices are sharded by a hash of their hostname, so a device stays in the same
+        shard however the device list is ordered.
+
+        :param settings: NSO settings
+        :type settings: dict
+        :param options: parsed command line
+        :type options: argparse.Namespace
+        :param devices: hostnames of devices
+        :type devices: list[str]
+
+        :return: result of the command for each device
+        :rtype: dict[str] = any
+    """
+
+    processes = min(options.processes, len(devices))
+    _, kwargs = commandArguments(options)
+
+    if processes <= 1:
+        shards = { None: devices }
+    else:
+        shards = {}
+        for device in devices:
+            shards.setdefault(zlib.crc32(device.encode()) % processes, []).append(device)
+
+    if kwargs.get("journal") and kwargs.get("resume"):
+        splitJournals(settings, kwargs["journal"], shards)
+    elif kwargs.get("journal"):
+        clearJournals(settings, kwargs["journal"])
+
+    if processes <= 1:
+        return runShard(settings, options, devices)
+
+    results = {}
+
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        futures = [executor.submit(runShard, settings, options, shard_devices, shard, processes) for shard, shard_devices in shards.items()]
+        for future in futures:
+            results.update(future.result())
+
+    return {device: results[device] for device in devices}
+
+
+def writeCSV(command, results, stream):
+    """
+        Writes the results of a command as CSV.
+
+        :param command: command that was run
+        :type command: str
+        :param results: result of the command for each device
+        :type results: dict[str] = any
+        :param stream: file the CSV is written to
+        :type stream: file
+    """
+
+    writer = csv.writer(stream)
+
+    if command == "poll":
+        writer.writerow(["device", "active", "cumulative", "peak"])
+        for device, sessions in results.items():
+            sessions = sessions if sessions else {}
+            writer.writerow([device, sessions.get("active"), sessions.get("cumulative"), sessions.get("peak")])
+
+    elif command == "audit":
+        writer.writerow(["device", "policy", "webvpn", "group_policy", "domains_missing", "domains_extra"])
+        for device, audit in results.items():
+            for policy, checks in (audit if audit else {}).items():
+                if not checks:
+                    writer.writerow([device, policy, "error"])
+                    continue
+
+                writer.writerow([
+                    device,
+                    policy,
+                    checks["webvpn"],
+                    checks["group_policy"],
+                    " ".join(checks["domains_missing"]),
+                    " ".join(checks["domains_extra"])
+                ])
+
+    elif command in ("update", "clear-split"):
+        writer.writerow(["device", "success"])
+        for device, result in results.items():
+            writer.writerow([device, "" if result is None else isSuccess(result)])
+
+    else:
+        writer.writerow(["device", "result"])
+        for device, result in results.items():
+            writer.writerow([device, result])
+
+
+def parseArguments(argv):
+    """
+        Parses the command line.
+
+        :param argv: command line arguments
+        :type argv: list[str]
+
+        :return: parsed command line
+        :rtype: argparse.Namespace
+    """
+
+    common = argparse.ArgumentParser(add_help=False)
+
+    nso = common.add_argument_group("NSO")
+    nso.add_argument("--config", help="JSON file with nso_server, nso_port, username, password, or nodes and device_map")
+    nso.add_argument("--nso-server", dest="nso_server")
+    nso.add_argument("--nso-port", dest="nso_port")
+    nso.add_argument("--username")
+    nso.add_argument("--password", help="defaults to the NSO_PASSWORD environment variable")
+    nso.add_argument("--transport", choices=["http1", "http2"], default="http1")
+
+    devices = common.add_argument_group("devices")
+    devices.add_argument("--devices", help="comma separated device hostnames")
+    devices.add_argument("--devices-file", help="file with one device hostname per line")
+    devices.add_argument("--discover", action="store_true", help="discover devices from NSO")
+    devices.add_argument("--device-group", help="only discover members of this device group")
+    devices.add_argument("--ned-id", default="cisco-asa", help="only discover devices with this NED")
+    devices.add_argument("--inventory-cache", help="file caching the discovered inventory between runs")
+
+    output = common.add_argument_group("output")
+    output.add_argument("--format", choices=["json", "csv"], default="json")
+    output.add_argument("--report", help="file the results are written to, defaults to stdout")
+
+    scale = common.add_argument_group("scale")
+    scale.add_argument("--processes", type=int, default=1, help="worker processes the devices are sharded across, not with --waves")
+    scale.add_argument("--parse-workers", type=int, default=0, help="worker processes parsing device outputs per client")
+
+    sweep = argparse.ArgumentParser(add_help=False)
+    sweep.add_argument("--journal", help="checkpoint journal of the sweep, one per shard when sharding")
+    sweep.add_argument("--resume", action="store_true", help="only work on devices the journal doesn't have as succeeded")
+
+    split = argparse.ArgumentParser(add_help=False)
+    split.add_argument("--group-policy", required=True)
+
+    domains = argparse.ArgumentParser(add_help=False)
+    domains.add_argument("--exclude-domains", help="comma separated domains that should be split tunneled")
+    domains.add_argument("--exclude-domains-file", help="file with one exclude domain per line")
+    domains.add_argument("--include-domains", help="comma separated domains that should not be split tunneled")
+    domains.add_argument("--include-domains-file", help="file with one include domain per line")
+
+    rollout = argparse.ArgumentParser(add_help=False)
+    rollout.add_argument("--waves", help="comma separated rollout wave sizes, such as 1,5,25")
+    rollout.add_argument("--failure-threshold", type=float, default=0.1, help="share of failed devices in a wave that halts the rollout")
+    rollout.add_argument("--verify", action="store_true", help="audit changed devices after every wave")
+
+    parser = argparse.ArgumentParser(description="Runs NSO Wrangler sweeps without the interactive menus.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    commands.add_parser("poll", parents=[common], help="pull VPN session data")
+    commands.add_parser("clear", parents=[common], help="clear VPN session data")
+    kick = commands.add_parser("kick", parents=[common], help="log off all users from devices")
+    kick.add_argument("--confirm", action="store_true", required=True, help="required, logs off every VPN user")
+    audit = commands.add_parser("audit", parents=[common, sweep, split, domains], help="audit FQDN split tunneling")
+    audit.add_argument("--from-cdb", action="store_true", help="audit from NSO's copy of the configuration")
+    commands.add_parser("update", parents=[common, sweep, split, domains, rollout], help="update FQDN split tunneling")
+    commands.add_parser("clear-split", parents=[common, sweep, split, rollout], help="clear FQDN split tunneling")
+
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    """
+        Entry point of the command line.
+
+        :param argv: command line arguments, defaults to sys.argv
+        :type argv: list[str]
+
+        :return: exit status, 1 if a command changing devices failed on any device
+        :rtype: int
+    """
+
+    options = parseArguments(argv)
+    settings = loadSettings(options)
+
+    if "nodes" not in settings:
+        missing = [key for key in ("nso_server", "nso_port", "username", "password") if key not in settings]
+        if missing:
+            print(f"Missing NSO settings: {', '.join(missing)}", file=sys.stderr)
+            return 2
+
+    if options.processes > 1 and getattr(options, "waves", None):
+        print("--waves can't be combined with --processes, a rollout has to run in one process.", file=sys.stderr)
+        return 2
+
+    devices = loadDevices(settings, options)
+    if not devices:
+        print("No devices given, use --devices, --devices-file, or --discover.", file=sys.stderr)
+        return 2
+
+    results = runCommand(settings, options, devices)
+
+    stream = open(options.report, "w", newline="") if options.report else sys.stdout
+    try:
+        if options.format == "csv":
+            writeCSV(options.command, results, stream)
+        else:
+            json.dump(results, stream, indent=4, default=str)
+            stream.write("\n")
+    finally:
+        if options.report:
+            stream.close()
+
+    if options.command in WRITE_COMMANDS:
+        failed = [device for device, result in results.items() if not isSuccess(result)]
+        if failed:
+            print(f"Failed on {len(failed)} of {len(devices)} devices: {', '.join(failed)}", file=sys.stderr)
+            return 1
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
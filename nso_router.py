@@ -0,0 +1,234 @@
+"""NSO Wrangler API Program.
+Copyright (c) 2020 Cisco and/or its affiliates.
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+               https://developer.cisco.com/docs/licenses
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+"""
+
+__author__ = "Drew Taylor"
+__email__ = "dretaylo@cisco.com"
+__version__ = "0.1.1"
+__copyright__ = "Copyright (c) 2020 Cisco and/or its affiliates."
+__license__ = "Cisco Sample Code License, Version 1.1"
+
+
+from concurrent.futures import ThreadPoolExecutor
+
+from nso_wrangler import NSOWrangler
+
+
+class NSORouter:
+    def __init__(self, nodes, device_map=None, wrangler_class=NSOWrangler, discover=None, **kwargs):
+        """
+            Routes calls for a fleet of devices spread across several NSO servers.
+            Keeps a client, with its own connection pool and governor, for each NSO node.
+            Master functions are split by node, run on every node in parallel, and their results merged.
+            Any method of the wrangler class can be called on the router, such as
+            router.pullAllDeviceSessionData(devices) or router.logoffUser(device, user).
+
+            :param nodes: connection settings for each NSO node, such as
+                { "east": { "nso_server": "nso-east", "nso_port": "8888", "username": "user1", "password": "pass1" } }
+            :type nodes: dict[str] = dict
+            :param device_map: NSO node managing each device
+            :type device_map: dict[str] = str
+            :param wrangler_class: NSOWrangler or a subclass such as Poller or SplitTunnelManager
+            :type wrangler_class: type
+            :param discover: if given, arguments for discoverDevices used to map the devices of every node
+            :type discover: dict
+            :param kwargs: connection options passed to every node's client
+            :type kwargs: dict
+        """
+
+        self.wrangler_class = wrangler_class
+        self.clients = {node: wrangler_class(**settings, **kwargs) for node, settings in nodes.items()}
+        self.device_map = dict(device_map) if device_map else {}
+
+        self.logger = next(iter(self.clients.values())).logger
+        self.logger.info(f"Initializing NSO Router for nodes {list(self.clients)}")
+
+        if discover is not None:
+            self.discoverDevices(**discover)
+
+    def __getattr__(self, name):
+        """
+            Routes a method of the wrangler class to the NSO nodes managing the devices.
+            Called with a device the method runs on that device's node, called with a list
+            of devices it runs on every node in parallel.
+
+            :param name: name of the method
+            :type name: str
+
+            :return: method routed across the NSO nodes
+            :rtype: callable
+        """
+
+        if name.startswith("_") or not callable(getattr(self.__dict__.get("wrangler_class"), name, None)):
+            raise AttributeError(name)
+
+        def routed(devices, *args, **kwargs):
+            if isinstance(devices, str):
+                client = self.route(devices)
+                return getattr(client, name)(devices, *args, **kwargs) if client else False
+
+            return self.dispatch(name, devices, *args, **kwargs)
+
+        return routed
+
+    def _runOnNodes(self, function, nodes):
+        """
+            Runs a function for every NSO node in parallel.
+
+            :param function: function taking a node name and its client
+            :type function: callable
+            :param nodes: names of the nodes
+            :type nodes: list[str]
+
+            :return: result of the function for each node
+            :rtype: dict[str] = any
+        """
+
+        if not nodes:
+            return {}
+
+        with ThreadPoolExecutor(max_workers=len(nodes)) as executor:
+            futures = {node: executor.submit(function, node, self.clients[node]) for node in nodes}
+
+        return {node: future.result() for node, future in futures.items()}
+
+    def discoverDevices(self, **kwargs):
+        """
+            Discovers the devices of every NSO node and maps them to their node.
+
+            :param kwargs: arguments for NSOWrangler.discoverDevices
+            :type kwargs: dict
+
+            :return: hostnames of the discovered devices
+            :rtype: list[str]
+        """
+
+        discovered = self._runOnNodes(lambda node, client: client.discoverDevices(**kwargs), list(self.clients))
+        devices = []
+
+        for node, node_devices in discovered.items():
+            for device in node_devices:
+                if self.device_map.get(device, node) != node:
+                    self.logger.warning(f"{device}:\tManaged by {self.device_map[device]} and {node}, keeping {self.device_map[device]}.")
+                    continue
+
+                self.device_map[device] = node
+                devices.append(device)
+
+        return devices
+
+    def close(self):
+        """
+            Closes the client of every NSO node.
+        """
+
+        for client in self.clients.values():
+            client.close()
+
+    def route(self, device):
+        """
+            Looks up the client of the NSO node managing a device.
+
+            :param device: hostname of device
+            :type device: str
+
+            :return: client of the NSO node, None if no node manages the device
+            :rtype: NSOWrangler
+        """
+
+        node = self.device_map.get(device)
+
+        if node not in self.clients:
+            self.logger.error(f"{device}:\tNot managed by any NSO node.")
+            return None
+
+        return self.clients[node]
+
+    def dispatch(self, method, devices, *args, **kwargs):
+        """
+            Master function to run a master function of the wrangler class across NSO nodes.
+            A journal filename gets one journal per node, suffixed with the node name.
+
+            :param method: name of the master function, such as "auditDevices"
+            :type method: str
+            :param devices: hostnames of devices the function is run for
+            :type devices: list[str]
+            :param args: arguments passed to the function after the devices
+            :type args: list
+            :param kwargs: keyword arguments passed to the function
+            :type kwargs: dict
+
+            :return: result of the function for each device
+            :rtype: dict[str] = any
+        """
+
+        node_devices = {}
+        results = {}
+
+        for device in devices:
+            if self.route(device) is None:
+                results[device] = False
+                continue
+            node_devices.setdefault(self.device_map[device], []).append(device)
+
+        def runOnNode(node, client):
+            node_kwargs = dict(kwargs)
+            if isinstance(node_kwargs.get("journal"), str):
+                node_kwargs["journal"] = f"{node_kwargs['journal']}.{node}"
+
+            return getattr(client, method)(node_devices[node], *args, **node_kwargs)
+
+        for node_results in self._runOnNodes(runOnNode, list(node_devices)).values():
+            results.update(node_results)
+
+        return {device: results[device] for device in devices}
+
+    def runCommandsOnDevices(self, devices, commands, success_message="", failure_message="", **kwargs):
+        """
+            Master function to run commands on multiple devices across NSO nodes.
+
+            :param devices: hostnames of devices commands are intended for
+            :type devices: list[str]
+            :param commands: commands for device separated into a list
+            :type commands: list[str]
+            :param success_message: specific output from device that denotes success
+            :type success_message: str
+            :param failure_message: specific output from device that denotes failure
+            :type failure_message: str
+            :param kwargs: options passed to NSOWrangler.runCommandsOnDevices
+            :type kwargs: dict
+
+            :return: response from NSO for each device
+            :rtype: dict[str] = str
+        """
+
+        return self.dispatch("runCommandsOnDevices", devices, commands, success_message, failure_message, **kwargs)
+
+
+if __name__ == "__main__":
+    print("\nnso_router.py\n")
+
+    NODES = {
+        'east': { 'nso_server': 'nso-east', 'nso_port': '8080', 'username': 'user1', 'password': 'pass1' },
+        'west': { 'nso_server': 'nso-west', 'nso_port': '8080', 'username': 'user1', 'password': 'pass1' },
+    }
+    DEVICE_MAP = { 'vpn-device-1': 'east', 'vpn-device-2': 'west' }
+    COMMANDS = ['show run route']
+
+    nso_router = NSORouter(
+        nodes=NODES,
+        device_map=DEVICE_MAP,
+        console=True
+    )
+
+    nso_router.runCommandsOnDevices(list(DEVICE_MAP), COMMANDS)
@@ -20,13 +20,674 @@ __license__ = "Cisco Sample Code License, Version 1.1"
 
 
 import requests
+from requests.adapters import HTTPAdapter
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 import json
 import logging
+import math
+import multiprocessing
 from logging.handlers import RotatingFileHandler
+import os
+import threading
+import time
+from collections import deque
+from urllib.parse import quote
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BULK = 1
+
+READ_ONLY_COMMANDS = ("show",)
+
+# Seconds to wait before logging in again after NSO failed a login.
+LOGIN_BACKOFF = 30.0
+
+# Largest set of devices read from the device tree one key at a time, larger sets are read a page at a time.
+KEY_READ_LIMIT = 25
+
+
+def isSuccess(result):
+    """
+        Decides if the result of a per-device function is a success.
+        Results made up of per-part results, such as {'exclude': True, 'include': False},
+        fail if any part returned False.
+
+        :param result: result of a per-device function
+        :type result: any
+
+        :return: True if the result is a success
+        :rtype: bool
+    """
+
+    if isinstance(result, dict) and result:
+        return all(value is not False for value in result.values())
+
+    return bool(result)
+
+
+def decodeExecResponse(raw, parser=None, parser_args=(), failure_message=""):
+    """
+        Decodes NSO's response to a live-status exec and optionally parses the device output.
+
+        :param raw: body of NSO's response
+        :type raw: bytes
+        :param parser: module-level function turning the device output into a result
+        :type parser: callable
+        :param parser_args: arguments passed to the parser after the output
+        :type parser_args: tuple
+        :param failure_message: specific output from device that denotes failure
+        :type failure_message: str
+
+        :return: errors from NSO, and the output or parsed result (False if the device reported failure)
+        :rtype: tuple(list, any)
+    """
+
+    device_data = json.loads(raw)
+
+    if "errors" in device_data:
+        return device_data["errors"], False
+
+    output = device_data["tailf-ned-cisco-asa-stats:output"]["result"]
+
+    if failure_message and failure_message in output:
+        return None, False
+
+    return None, parser(output, *parser_args) if parser else output
+
+
+def _runParseBatch(tasks):
+    """
+        Runs a batch of parse tasks in a parse worker process.
+
+        :param tasks: functions with their arguments
+        :type tasks: list[tuple(callable, tuple)]
+
+        :return: for each task, if it succeeded and its result or exception
+        :rtype: list[tuple(bool, any)]
+    """
+
+    outcomes = []
+
+    for function, args in tasks:
+        try:
+            outcomes.append((True, function(*args)))
+        except Exception as error:
+            outcomes.append((False, error))
+
+    return outcomes
+
+
+class NSOGovernor:
+    def __init__(
+        self,
+        rate=20.0,
+        burst=None,
+        min_concurrency=1,
+        max_concurrency=16,
+        initial_concurrency=4,
+        latency_target=5.0,
+        reserved_share=0.25
+    ):
+        """
+            Client-side rate limit, adaptive concurrency, and priority scheduling for calls to an NSO server.
+            Requests draw from a token bucket and wait for a free in-flight slot.
+            The number of slots grows by one per window of healthy responses and is
+            halved when NSO answers slowly, fails, or returns 503.
+            Interactive requests are queued apart from bulk sweeps, always get the next
+            free slot, and have a share of the slots reserved that bulk requests can't use.
+
+            :param rate: requests per second allowed to NSO, None for no limit
+            :type rate: float
+            :param burst: number of requests that can be sent at once, defaults to rate
+            :type burst: int
+            :param min_concurrency: lowest number of requests allowed in flight
+            :type min_concurrency: int
+            :param max_concurrency: highest number of requests allowed in flight
+            :type max_concurrency: int
+            :param initial_concurrency: number of requests allowed in flight at start
+            :type initial_concurrency: int
+            :param latency_target: response time in seconds above which NSO is considered loaded
+            :type latency_target: float
+            :param reserved_share: fraction of slots kept free for interactive requests, at least one while there are two
+            :type reserved_share: float
+        """
+
+        self.rate = rate
+        self.burst = burst if burst else max(1, rate or 1)
+        self.min_concurrency = min_concurrency
+        self.max_concurrency = max_concurrency
+        self.concurrency = float(min(max(initial_concurrency, min_concurrency), max_concurrency))
+        self.latency_target = latency_target
+        self.reserved_share = reserved_share
+
+        self._queues = { PRIORITY_INTERACTIVE: deque(), PRIORITY_BULK: deque() }
+        self._tokens = float(self.burst)
+        self._last_refill = time.monotonic()
+        self._last_decrease = 0.0
+        self._in_flight = 0
+        self._condition = threading.Condition()
+
+    def _refill(self):
+        """
+            Adds the tokens earned since the last refill to the bucket.
+        """
+
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._last_refill) * self.rate)
+        self._last_refill = now
+
+    def _hasSlot(self, ticket, priority):
+        """
+            Checks if a queued request is next in line and a slot is free for its priority.
+
+            :param ticket: marker of the queued request
+            :type ticket: object
+            :param priority: PRIORITY_INTERACTIVE or PRIORITY_BULK
+            :type priority: int
+
+            :return: True if the request may take a slot
+            :rtype: bool
+        """
+
+        if self._queues[priority][0] is not ticket:
+            return False
+
+        limit = int(self.concurrency)
+
+        if priority == PRIORITY_BULK:
+            if self._queues[PRIORITY_INTERACTIVE]:
+                return False
+            # Round up so a loaded NSO, with only a few slots left, still keeps one for interactive requests.
+            limit -= min(math.ceil(limit * self.reserved_share), limit - 1)
+
+        return self._in_flight < limit
+
+    def acquire(self, priority=PRIORITY_INTERACTIVE):
+        """
+            Blocks until a request may be sent to NSO.
+
+            :param priority: PRIORITY_INTERACTIVE or PRIORITY_BULK
+            :type priority: int
+        """
+
+        ticket = object()
+
+        with self._condition:
+            self._queues[priority].append(ticket)
+
+            try:
+                while True:
+                    if not self._hasSlot(ticket, priority):
+                        self._condition.wait()
+                        continue
+
+                    if self.rate is None:
+                        break
+
+                    self._refill()
+                    if self._tokens >= 1:
+                        self._tokens -= 1
+                        break
+
+                    self._condition.wait((1 - self._tokens) / self.rate)
+            finally:
+                self._queues[priority].remove(ticket)
+                self._condition.notify_all()
+
+            self._in_flight += 1
+
+    def release(self, latency, success):
+        """
+            Frees the slot of a finished request and adapts the concurrency to NSO's health.
+
+            :param latency: response time of the request in seconds
+            :type latency: float
+            :param success: False if the request failed or NSO reported being overloaded
+            :type success: bool
+        """
+
+        with self._condition:
+            self._in_flight -= 1
+
+            if success and latency <= self.latency_target:
+                self.concurrency = min(self.max_concurrency, self.concurrency + 1 / self.concurrency)
+            else:
+                # Only back off once per latency window so a burst of slow
+                # responses from the same overload doesn't collapse the limit.
+                now = time.monotonic()
+                if now - self._last_decrease >= self.latency_target:
+                    self.concurrency = max(self.min_concurrency, self.concurrency / 2)
+                    self._last_decrease = now
+
+            self._condition.notify_all()
+
+
+class SingleFlight:
+    def __init__(self):
+        """
+            Coalesces identical calls that are in flight at the same time.
+            The first caller does the work and every caller waiting on the same key gets its result.
+        """
+
+        self._flights = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, function, *args):
+        """
+            Runs the function unless an identical call is already in flight, then waits for that one.
+
+            :param key: identity of the call
+            :type key: tuple
+            :param function: function doing the work
+            :type function: callable
+            :param args: arguments passed to the function
+            :type args: list
+
+            :return: result of the function
+            :rtype: any
+        """
+
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = Future()
+
+        if not leader:
+            return flight.result()
+
+        try:
+            result = function(*args)
+        except BaseException as error:
+            flight.set_exception(error)
+            raise
+        else:
+            flight.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del self._flights[key]
+
+
+class SweepJournal:
+    def __init__(self, filename):
+        """
+            Append-only checkpoint journal of a sweep, one compact JSON line per finished device.
+            A sweep resumed from the journal only works on devices that haven't succeeded yet.
+
+            :param filename: path of the journal file
+            :type filename: str
+        """
+
+        self.filename = filename
+        self._lock = threading.Lock()
+
+    def reset(self):
+        """
+            Empties the journal for a new sweep.
+        """
+
+        with self._lock:
+            open(self.filename, "w").close()
+
+    def load(self):
+        """
+            Reads the latest entry of every device in the journal.
+            A line torn by a crash while it was being written is skipped.
+
+            :return: entry with status and result for each device
+            :rtype: dict[str] = dict
+        """
+
+        entries = {}
+
+        if not os.path.exists(self.filename):
+            return entries
+
+        with self._lock:
+            with open(self.filename) as journal_file:
+                for line in journal_file:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue
+                    entries[entry["device"]] = entry
+
+        return entries
+
+    def record(self, device, success, result):
+        """
+            Appends the outcome of a device to the journal and flushes it to disk.
+
+            :param device: hostname of device
+            :type device: str
+            :param success: if the device finished successfully
+            :type success: bool
+            :param result: result of the sweep for the device
+            :type result: any
+        """
+
+        entry = { "device": device, "status": "ok" if success else "failed", "result": result }
+        line = json.dumps(entry, separators=(",", ":"), default=str)
+
+        with self._lock:
+            with open(self.filename, "ab+") as journal_file:
+                # Terminate a line torn by a previous crash so it can't swallow this entry.
+                if journal_file.tell():
+                    journal_file.seek(-1, os.SEEK_END)
+                    if journal_file.read(1) != b"\n":
+                        journal_file.write(b"\n")
+
+                journal_file.write(line.encode() + b"\n")
+                journal_file.flush()
+                os.fsync(journal_file.fileno())
+
+
+class ParsePool:
+    def __init__(self, workers=None, batch_size=32, batch_bytes=262144, batch_window=0.005):
+        """
+            Process pool that decodes and parses device outputs off the I/O threads.
+            Small outputs are gathered into batches so one round trip to a worker
+            carries many of them, large outputs are sent on their own.
+            Workers are started by a fork server, not forked from the threaded client,
+            so they don't inherit locks held by its I/O threads. If a worker dies, the tasks
+            it had fail and the pool is started again for the next ones.
+
+            :param workers: number of worker processes, defaults to the number of CPUs
+            :type workers: int
+            :param batch_size: tasks sent to a worker at once
+            :type batch_size: int
+            :param batch_bytes: bytes of input at which a batch is sent, or a task is sent on its own
+            :type batch_bytes: int
+            :param batch_window: seconds a batch waits for more tasks before being sent
+            :type batch_window: float
+        """
+
+        self.workers = workers
+        self.executor = self._createExecutor()
+        self.batch_size = batch_size
+        self.batch_bytes = batch_bytes
+        self.batch_window = batch_window
+
+        self._pending = []
+        self._pending_bytes = 0
+        self._timer = None
+        self._lock = threading.Lock()
+
+    def _createExecutor(self):
+        """
+            Starts the worker processes.
+
+            :return: executor running the worker processes
+            :rtype: ProcessPoolExecutor
+        """
+
+        start_method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+
+        return ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context(start_method))
+
+    def _replaceBroken(self, executor):
+        """
+            Starts new worker processes in place of a pool broken by a dead worker.
+
+            :param executor: executor found broken
+            :type executor: ProcessPoolExecutor
+        """
+
+        with self._lock:
+            if self.executor is not executor:
+                return
+            self.executor = self._createExecutor()
+
+        executor.shutdown(wait=False)
+
+    def _takeBatch(self):
+        """
+            Takes the pending tasks as a batch. Must be called holding the lock.
+
+            :return: pending tasks
+            :rtype: list[tuple(Future, callable, tuple)]
+        """
+
+        batch = self._pending
+        self._pending = []
+        self._pending_bytes = 0
+
+        if self._timer:
+            self._timer.cancel()
+            self._timer = None
+
+        return batch
+
+    def _flush(self):
+        """
+            Sends the pending tasks once the batch window has passed.
+        """
+
+        with self._lock:
+            batch = self._takeBatch()
+
+        if batch:
+            self._sendBatch(batch)
+
+    def _sendBatch(self, batch):
+        """
+            Sends a batch of tasks to a worker and hands each result to its future.
+
+            :param batch: tasks with the futures waiting on them
+            :type batch: list[tuple(Future, callable, tuple)]
+        """
+
+        def fail(error):
+            for future, _, _ in batch:
+                future.set_exception(error)
+
+        def deliver(done):
+            try:
+                outcomes = done.result()
+            except BrokenProcessPool as error:
+                fail(error)
+                self._replaceBroken(executor)
+                return
+            except Exception as error:
+                fail(error)
+                return
+
+            for (future, _, _), (success, value) in zip(batch, outcomes):
+                if success:
+                    future.set_result(value)
+                else:
+                    future.set_exception(value)
+
+        tasks = [(function, args) for _, function, args in batch]
+        executor = self.executor
+
+        # Runs on the batch timer's thread too, so every failure has to reach the futures or their callers hang.
+        try:
+            executor.submit(_runParseBatch, tasks).add_done_callback(deliver)
+        except BrokenProcessPool as error:
+            fail(error)
+            self._replaceBroken(executor)
+        except Exception as error:
+            fail(error)
+
+    def parse(self, function, *args, size=0):
+        """
+            Runs a module-level function in a worker process and waits for its result.
+
+            :param function: module-level function doing the parsing
+            :type function: callable
+            :param args: arguments passed to the function
+            :type args: list
+            :param size: bytes of input, used to decide how it's batched
+            :type size: int
+
+            :return: result of the function
+            :rtype: any
+        """
+
+        future = Future()
+        task = (future, function, args)
+
+        if size >= self.batch_bytes:
+            self._sendBatch([task])
+            return future.result()
+
+        batch = None
+        with self._lock:
+            self._pending.append(task)
+            self._pending_bytes += size
+
+            if len(self._pending) >= self.batch_size or self._pending_bytes >= self.batch_bytes:
+                batch = self._takeBatch()
+            elif not self._timer:
+                self._timer = threading.Timer(self.batch_window, self._flush)
+                self._timer.daemon = True
+                self._timer.start()
+
+        if batch:
+            self._sendBatch(batch)
+
+        return future.result()
+
+    def close(self):
+        """
+            Sends any pending tasks and shuts the worker processes down.
+        """
+
+        self._flush()
+        self.executor.shutdown()
+
+
+class RequestsTransport:
+    def __init__(self, pool_size=10):
+        """
+            HTTP/1.1 transport to NSO over a pooled requests session.
+            Every request in flight needs its own connection.
+
+            :param pool_size: number of HTTPS connections kept open to NSO
+            :type pool_size: int
+        """
+
+        self.session = requests.Session()
+        self.session.verify = False
+        self.session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=pool_size))
+
+    @property
+    def cookies(self):
+        """
+            Cookies NSO has set on the transport.
+        """
+
+        return self.session.cookies
+
+    def request(self, method, url, auth=None, **kwargs):
+        """
+            Sends a request to NSO.
+
+            :param method: HTTP method of the request
+            :type method: str
+            :param url: full URL of the request
+            :type url: str
+            :param auth: username and password for Basic authentication
+            :type auth: tuple(str, str)
+
+            :return: response from NSO
+            :rtype: requests.Response
+        """
+
+        return self.session.request(method, url=url, auth=auth, **kwargs)
+
+    def close(self):
+        """
+            Closes the connections to NSO.
+        """
+
+        self.session.close()
+
+
+class HTTP2Transport:
+    def __init__(self, connections=2, max_streams=100):
+        """
+            HTTP/2 transport to NSO which multiplexes many requests over a few connections.
+            Requires the optional httpx[http2] package.
+
+            :param connections: number of HTTPS connections opened to NSO
+            :type connections: int
+            :param max_streams: requests multiplexed over one connection, keep at or below NSO's stream limit
+            :type max_streams: int
+        """
+
+        if httpx is None:
+            raise ImportError("HTTP/2 transport requires httpx[http2]")
+
+        self.client = httpx.Client(
+            http2=True,
+            verify=False,
+            limits=httpx.Limits(max_connections=connections, max_keepalive_connections=connections)
+        )
+        self._streams = threading.BoundedSemaphore(connections * max_streams)
+
+    @property
+    def cookies(self):
+        """
+            Cookies NSO has set on the transport.
+        """
+
+        return self.client.cookies
+
+    def request(self, method, url, auth=None, data=None, **kwargs):
+        """
+            Sends a request to NSO once a stream is free.
+
+            :param method: HTTP method of the request
+            :type method: str
+            :param url: full URL of the request
+            :type url: str
+            :param auth: username and password for Basic authentication
+            :type auth: tuple(str, str)
+            :param data: body of the request
+            :type data: str
+
+            :return: response from NSO
+            :rtype: httpx.Response
+        """
+
+        with self._streams:
+            return self.client.request(method, url, auth=auth, content=data, **kwargs)
+
+    def close(self):
+        """
+            Closes the connections to NSO.
+        """
+
+        self.client.close()
 
 
 class NSOWrangler:
-    def __init__(self, nso_server, nso_port, username, password, console=False):
+    _governors = {}
+    _flights = {}
+    _shared_lock = threading.Lock()
+
+    def __init__(
+        self,
+        nso_server,
+        nso_port,
+        username,
+        password,
+        console=False,
+        session_auth=True,
+        pool_size=None,
+        governor=None,
+        transport="http1",
+        parse_workers=0
+    ):
         """
             API wrapper client for HTTPS calls to NSO.
 
@@ -40,6 +701,16 @@ class NSOWrangler:
             :type password: str
             :param console: if True prints results to console
             :type console: bool
+            :param session_auth: if True logs in once and reuses the NSO session cookie
+            :type session_auth: bool
+            :param pool_size: number of HTTPS connections kept open to NSO, defaults to the governor's max concurrency
+            :type pool_size: int
+            :param governor: rate and concurrency limits for NSO, defaults to one shared per NSO server
+            :type governor: NSOGovernor
+            :param transport: "http1", "http2", or a transport object
+            :type transport: str or RequestsTransport or HTTP2Transport
+            :param parse_workers: worker processes decoding and parsing device outputs, 0 to parse in the calling thread
+            :type parse_workers: int
         """
 
         self.logger = self._initalizeLogs()
@@ -49,9 +720,28 @@ class NSOWrangler:
         self.nso_port = nso_port
         self.username = username
         self.password = password
-        self.base_api_url = f"https://{self.nso_server}:{self.nso_port}/restconf/operations/devices"
+        self.base_url = f"https://{self.nso_server}:{self.nso_port}/restconf"
+        self.base_api_url = f"{self.base_url}/operations/devices"
+        self.base_data_url = f"{self.base_url}/data"
 
         self.console = console
+        self._lane = threading.local()
+        self._data_cache = {}
+        self.parse_pool = ParsePool(parse_workers) if parse_workers else None
+
+        self.governor = governor if governor else self._sharedForServer(NSOWrangler._governors, NSOGovernor)
+        self.flights = self._sharedForServer(NSOWrangler._flights, SingleFlight)
+
+        self.session_auth = session_auth
+        self.pool_size = pool_size if pool_size else self.governor.max_concurrency
+        self.transport = self._initializeTransport(transport, self.pool_size)
+        self._transport_lock = threading.Lock()
+        self._protocol_checked = not isinstance(self.transport, HTTP2Transport)
+        self._session_lock = threading.Lock()
+        self._session_generation = 0
+        self._session_active = False
+        self._login_rejected = False
+        self._login_retry_at = 0.0
 
     def _initalizeLogs(self):
         """
@@ -59,6 +749,12 @@ class NSOWrangler:
             Logs are contained within the file "./logs/poller-debug.log".
         """
 
+        logger = logging.getLogger(__name__)
+
+        # Every client in a process shares the logger, only the first one sets it up.
+        if logger.handlers:
+            return logger
+
         logger_file_handler = RotatingFileHandler(filename="./logs/poller-debug.log", maxBytes=2000000, backupCount=5)
         logger_file_handler.setLevel(logging.DEBUG)
         
@@ -67,7 +763,6 @@ class NSOWrangler:
 
         logging.captureWarnings(True)
 
-        logger = logging.getLogger(__name__)
         warnings_logger = logging.getLogger("py.warnings")
 
         logger.addHandler(logger_file_handler)
@@ -76,7 +771,386 @@ class NSOWrangler:
 
         return logger
 
-    def runCommandsOnDevices(self, devices, commands, success_message="", failure_message=""):
+    def close(self):
+        """
+            Shuts down the parse workers and closes the connections to NSO.
+            The client can't be used afterwards.
+        """
+
+        if self.parse_pool:
+            self.parse_pool.close()
+            self.parse_pool = None
+
+        if hasattr(self.transport, "close"):
+            self.transport.close()
+
+    def _sharedForServer(self, registry, factory):
+        """
+            Returns the object shared by every client of this NSO server,
+            so separate tools and subclasses coordinate their load on NSO.
+
+            :param registry: objects already created for each NSO server
+            :type registry: dict[tuple] = any
+            :param factory: creates the object for a new NSO server
+            :type factory: callable
+
+            :return: object for this NSO server
+            :rtype: any
+        """
+
+        with NSOWrangler._shared_lock:
+            key = (self.nso_server, str(self.nso_port))
+            if key not in registry:
+                registry[key] = factory()
+
+            return registry[key]
+
+    def _initializeTransport(self, transport, pool_size):
+        """
+            Creates the transport shared by every request to NSO.
+            Falls back to HTTP/1.1 when HTTP/2 support isn't installed.
+
+            :param transport: "http1", "http2", or a transport object
+            :type transport: str or RequestsTransport or HTTP2Transport
+            :param pool_size: number of HTTPS connections kept open to NSO over HTTP/1.1
+            :type pool_size: int
+
+            :return: transport used for all calls to NSO
+            :rtype: RequestsTransport or HTTP2Transport
+        """
+
+        if not isinstance(transport, str):
+            return transport
+
+        if transport == "http2":
+            try:
+                return HTTP2Transport()
+            except ImportError as error:
+                self.logger.warning(f"{error}, falling back to HTTP/1.1.")
+
+        return RequestsTransport(pool_size)
+
+    def _checkProtocol(self, response):
+        """
+            Checks the first response over the HTTP/2 transport actually used HTTP/2.
+            NSO without HTTP/2 enabled answers over HTTP/1.1, which would squeeze every
+            request through the HTTP/2 transport's few connections, so the client
+            switches to the pooled HTTP/1.1 transport instead.
+
+            :param response: response from NSO
+            :type response: httpx.Response
+        """
+
+        with self._transport_lock:
+            if self._protocol_checked:
+                return
+            self._protocol_checked = True
+
+            if getattr(response, "http_version", "HTTP/2") == "HTTP/2":
+                return
+
+            self.logger.warning(f"NSO answered over {response.http_version} instead of HTTP/2, switching to the HTTP/1.1 transport.")
+            cookies = dict(self.transport.cookies)
+            self.transport = RequestsTransport(self.pool_size)
+            self.transport.cookies.update(cookies)
+
+    def _login(self, session_generation):
+        """
+            Authenticates against NSO once and keeps the session cookie for reuse.
+            Threads that saw the same expired session share one re-login.
+            Rejected credentials stop all further logins, other failures pause
+            logins for LOGIN_BACKOFF seconds so a sweep doesn't hammer NSO's AAA.
+
+            :param session_generation: session generation the caller last used
+            :type session_generation: int
+        """
+
+        with self._session_lock:
+            if session_generation != self._session_generation:
+                return
+
+            self.logger.info("Logging in to NSO.")
+            self.transport.cookies.clear()
+            self._session_active = False
+
+            try:
+                response = self.transport.request(
+                    "GET",
+                    url=self.base_url,
+                    auth=(self.username, self.password),
+                    headers={ "Accept": "application/yang-data+json" }
+                )
+            except Exception:
+                self._login_retry_at = time.monotonic() + LOGIN_BACKOFF
+                raise
+            finally:
+                self._session_generation += 1
+
+            if not self._protocol_checked:
+                self._checkProtocol(response)
+
+            if response.status_code == 200 and self.transport.cookies:
+                self._session_active = True
+            elif response.status_code == 200:
+                self.logger.warning("NSO did not return a session cookie, using per-request authentication.")
+                self.session_auth = False
+            elif response.status_code in (401, 403):
+                self.logger.error(f"Login to NSO was rejected with status {response.status_code}, not retrying.")
+                self._login_rejected = True
+            else:
+                self.logger.error(f"Login to NSO failed with status {response.status_code}, retrying in {LOGIN_BACKOFF} seconds.")
+                self._login_retry_at = time.monotonic() + LOGIN_BACKOFF
+
+    def _request(self, method, url, priority=None, **kwargs):
+        """
+            Sends a request to NSO once the governor allows it.
+
+            :param method: HTTP method of the request
+            :type method: str
+            :param url: full URL of the request
+            :type url: str
+            :param priority: PRIORITY_INTERACTIVE or PRIORITY_BULK, defaults to the calling lane
+            :type priority: int
+
+            :return: response from NSO
+            :rtype: requests.Response
+        """
+
+        if priority is None:
+            priority = getattr(self._lane, "priority", PRIORITY_INTERACTIVE)
+
+        self.governor.acquire(priority)
+        start = time.monotonic()
+        success = False
+
+        try:
+            response = self._sendRequest(method, url, **kwargs)
+            success = response.status_code < 500 and response.status_code != 429
+        finally:
+            self.governor.release(time.monotonic() - start, success)
+
+        if response.status_code in (429, 503):
+            self.logger.warning(f"NSO is overloaded ({response.status_code}), backing off.")
+
+        return response
+
+    def _sendRequest(self, method, url, **kwargs):
+        """
+            Sends a request to NSO over the shared transport.
+            Reuses the NSO session cookie when available and logs in again once it expires.
+            While logins are paused after a failure, requests use Basic authentication alone.
+
+            :param method: HTTP method of the request
+            :type method: str
+            :param url: full URL of the request
+            :type url: str
+
+            :return: response from NSO
+            :rtype: requests.Response
+        """
+
+        if self._login_rejected:
+            raise RuntimeError("NSO rejected the login credentials.")
+
+        if self.session_auth:
+            session_generation = self._session_generation
+            if not self._session_active and time.monotonic() >= self._login_retry_at:
+                self._login(session_generation)
+                session_generation = self._session_generation
+
+            if self._login_rejected:
+                raise RuntimeError("NSO rejected the login credentials.")
+
+        if not self.session_auth or not self._session_active:
+            response = self.transport.request(method, url=url, auth=(self.username, self.password), **kwargs)
+            if not self._protocol_checked:
+                self._checkProtocol(response)
+            return response
+
+        response = self.transport.request(method, url=url, **kwargs)
+
+        if response.status_code == 401:
+            self.logger.info("NSO session expired, logging in again.")
+            self._login(session_generation)
+            if self._login_rejected:
+                raise RuntimeError("NSO rejected the login credentials.")
+            auth = None if self._session_active else (self.username, self.password)
+            response = self.transport.request(method, url=url, auth=auth, **kwargs)
+
+        return response
+
+    def _mapDevices(
+        self,
+        function,
+        devices,
+        *args,
+        max_workers=None,
+        priority=PRIORITY_BULK,
+        journal=None,
+        resume=False
+    ):
+        """
+            Runs a per-device function over multiple devices in parallel.
+            The governor decides how many of the calls actually reach NSO at once.
+            Calls are made in the bulk lane so they don't hold up interactive requests.
+            With a journal every finished device is checkpointed, and a resumed sweep
+            only works on the devices that didn't succeed last time.
+
+            :param function: function taking a device followed by args
+            :type function: callable
+            :param devices: hostnames of devices the function is run for
+            :type devices: list[str]
+            :param args: arguments passed to the function after the device
+            :type args: list
+            :param max_workers: threads used, defaults to the governor's max concurrency
+            :type max_workers: int
+            :param priority: lane the calls to NSO are made in
+            :type priority: int
+            :param journal: checkpoint journal or its filename
+            :type journal: SweepJournal or str
+            :param resume: if True skips devices the journal has as succeeded
+            :type resume: bool
+
+            :return: result of the function for each device
+            :rtype: dict[str] = any
+        """
+
+        max_workers = max_workers if max_workers else self.governor.max_concurrency
+        finished = {}
+
+        if isinstance(journal, str):
+            journal = SweepJournal(journal)
+
+        if journal and resume:
+            for device, entry in journal.load().items():
+                if entry["status"] == "ok":
+                    finished[device] = entry["result"]
+            self.logger.info(f"Resuming sweep from {journal.filename}, {len(finished)} devices already finished.")
+        elif journal:
+            journal.reset()
+
+        def runInLane(device):
+            self._lane.priority = priority
+            result = function(device, *args)
+
+            if journal:
+                journal.record(device, isSuccess(result), result)
+
+            return result
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {device: executor.submit(runInLane, device) for device in devices if device not in finished}
+
+        return {device: finished[device] if device in finished else futures[device].result() for device in devices}
+
+    def _rolloutDevices(
+        self,
+        function,
+        devices,
+        *args,
+        waves=(1, 5, 25),
+        failure_threshold=0.1,
+        verify=None,
+        max_workers=None,
+        journal=None,
+        resume=False
+    ):
+        """
+            Runs a per-device change over multiple devices in waves of growing size.
+            Each wave runs in parallel, then the rest of the devices follow at full concurrency.
+            After every wave the results are checked, optionally verified on the devices, and the
+            rollout halts when the share of failed devices in the wave is above the threshold.
+
+            :param function: function taking a device followed by args
+            :type function: callable
+            :param devices: hostnames of devices the change is rolled out to
+            :type devices: list[str]
+            :param args: arguments passed to the function after the device
+            :type args: list
+            :param waves: sizes of the waves before the rest of the devices
+            :type waves: list[int]
+            :param failure_threshold: share of failed devices in a wave that halts the rollout
+            :type failure_threshold: float
+            :param verify: function taking a device and returning True if the change is in place
+            :type verify: callable
+            :param max_workers: devices worked on in parallel, defaults to the governor's max concurrency
+            :type max_workers: int
+            :param journal: checkpoint journal or its filename
+            :type journal: SweepJournal or str
+            :param resume: if True skips devices the journal has as succeeded
+            :type resume: bool
+
+            :return: result of the function for each device, False for devices that failed verification,
+                None for devices not reached because the rollout halted
+            :rtype: dict[str] = any
+        """
+
+        max_workers = max_workers if max_workers else self.governor.max_concurrency
+        results = {device: None for device in devices}
+        remaining = list(devices)
+
+        if isinstance(journal, str):
+            journal = SweepJournal(journal)
+
+        if journal and resume:
+            for device, entry in journal.load().items():
+                if entry["status"] == "ok" and device in results:
+                    results[device] = entry["result"]
+            remaining = [device for device in devices if results[device] is None]
+        elif journal:
+            journal.reset()
+
+        # The journal is read once above, each wave only appends to it.
+        def runAndRecord(device, *function_args):
+            result = function(device, *function_args)
+            if journal:
+                journal.record(device, isSuccess(result), result)
+            return result
+
+        wave_sizes = list(waves) + [len(remaining)]
+
+        for wave_number, wave_size in enumerate(wave_sizes, start=1):
+            wave, remaining = remaining[:wave_size], remaining[wave_size:]
+            if not wave:
+                break
+
+            self.logger.info(f"Rollout wave {wave_number}: {len(wave)} devices.")
+            wave_results = self._mapDevices(runAndRecord, wave, *args, max_workers=min(len(wave), max_workers))
+            results.update(wave_results)
+
+            succeeded = [device for device in wave if isSuccess(wave_results[device])]
+            if verify and succeeded:
+                verified = self._mapDevices(verify, succeeded, max_workers=min(len(succeeded), max_workers))
+
+                for device in succeeded:
+                    if not verified[device]:
+                        self.logger.error(f"{device}:\tChange could not be verified, marking as failed.")
+                        results[device] = False
+                        if journal:
+                            journal.record(device, False, False)
+
+                succeeded = [device for device in succeeded if verified[device]]
+
+            failure_rate = 1 - len(succeeded) / len(wave)
+            if failure_rate > failure_threshold:
+                self.logger.error(
+                    f"Rollout halted after wave {wave_number}: {len(wave) - len(succeeded)} of {len(wave)} devices failed, "
+                    f"{len(remaining)} devices not reached."
+                )
+                break
+
+        return results
+
+    def runCommandsOnDevices(
+        self,
+        devices,
+        commands,
+        success_message="",
+        failure_message="",
+        max_workers=None,
+        journal=None,
+        resume=False
+    ):
         """
             Master function to run commands on multiple devices.
 
@@ -88,21 +1162,324 @@ class NSOWrangler:
             :type success_message: str
             :param failure_message: specific output from device that denotes failure
             :type failure_message: str
+            :param max_workers: devices worked on in parallel, defaults to the governor's max concurrency
+            :type max_workers: int
+            :param journal: checkpoint journal or its filename
+            :type journal: SweepJournal or str
+            :param resume: if True only runs commands on devices the journal doesn't have as succeeded
+            :type resume: bool
 
             :return: response from NSO for each device
             :rtype: dict[str] = str
         """
 
-        results = {}
+        return self._mapDevices(
+            self.runCommandsOnDevice,
+            devices,
+            commands,
+            success_message,
+            failure_message,
+            max_workers=max_workers,
+            journal=journal,
+            resume=resume
+        )
 
-        for device in devices:
-            results[device] = self.runCommandsOnDevice(device, commands, success_message, failure_message)
-        
-        return results
+    def _getData(self, path, params=None):
+        """
+            Reads from NSO's RESTCONF data tree.
+            Responses are cached with their ETag and revalidated with If-None-Match,
+            so unchanged data isn't downloaded again.
 
-    def runCommandsOnDevice(self, device, commands, success_message="", failure_message=""):
+            :param path: path of the resource below /restconf/data
+            :type path: str
+            :param params: query parameters such as fields, offset, and limit
+            :type params: dict[str] = str
+
+            :return: JSON data of the resource, empty if it doesn't exist
+            :rtype: dict
+        """
+
+        url = f"{self.base_data_url}/{path}"
+        key = json.dumps([url, params], sort_keys=True)
+        cached = self._data_cache.get(key)
+        headers = { "Accept": "application/yang-data+json" }
+
+        if cached:
+            headers["If-None-Match"] = cached["etag"]
+
+        response = self._request("GET", url=url, params=params, headers=headers)
+
+        if response.status_code == 304 and cached:
+            return cached["data"]
+        if response.status_code in (204, 404):
+            return {}
+
+        response.raise_for_status()
+        # Data pages are decoded here, sending them to the parse pool would copy every page twice.
+        data = json.loads(response.content) if response.content else {}
+
+        if response.headers.get("ETag"):
+            self._data_cache[key] = { "etag": response.headers["ETag"], "data": data }
+
+        return data
+
+    def _loadDataCache(self, cache_file):
+        """
+            Loads cached RESTCONF data saved by a previous run.
+
+            :param cache_file: path of the cache file
+            :type cache_file: str
+        """
+
+        try:
+            with open(cache_file) as cache:
+                self._data_cache.update(json.load(cache))
+        except (OSError, ValueError) as error:
+            self.logger.info(f"No usable data cache in {cache_file}: {error}")
+
+    def _saveDataCache(self, cache_file):
+        """
+            Saves cached RESTCONF data for the next run.
+
+            :param cache_file: path of the cache file
+            :type cache_file: str
+        """
+
+        with open(cache_file, "w") as cache:
+            json.dump(self._data_cache, cache, separators=(",", ":"))
+
+    def _getField(self, entry, field):
+        """
+            Looks up a possibly nested field of a RESTCONF list entry, such as "device-type/cli/ned-id".
+
+            :param entry: list entry from NSO
+            :type entry: dict
+            :param field: path of the field separated by "/"
+            :type field: str
+
+            :return: value of the field, None if missing
+            :rtype: any
+        """
+
+        for node in field.split("/"):
+            if not isinstance(entry, dict):
+                return None
+            entry = entry.get(node, entry.get(f"tailf-ncs:{node}"))
+
+        return entry
+
+    def _readDevices(self, devices, fields, page_size=500):
+        """
+            Reads fields of a set of devices from NSO's device tree.
+            Up to KEY_READ_LIMIT devices are read by key in parallel, larger sets are read
+            by paging through the device list until every device has been seen.
+
+            :param devices: hostnames of devices
+            :type devices: list[str]
+            :param fields: RESTCONF fields selector, such as "name;device-type/cli/ned-id"
+            :type fields: str
+            :param page_size: devices fetched per request when paging
+            :type page_size: int
+
+            :return: list entry of each device NSO has
+            :rtype: dict[str] = dict
+        """
+
+        wanted = set(devices)
+        entries = {}
+
+        if len(wanted) <= KEY_READ_LIMIT:
+            def readDevice(device):
+                try:
+                    return self._getData(
+                        f"tailf-ncs:devices/device={quote(device, safe='')}",
+                        { "fields": fields }
+                    ).get("tailf-ncs:device", [])
+                except Exception as error:
+                    self.logger.error(f"{device}:\tReading from NSO failed: {error}")
+                    return []
+
+            for found in self._mapDevices(readDevice, sorted(wanted)).values():
+                entries.update({entry["name"]: entry for entry in found})
+
+            return entries
+
+        offset = 0
+        while len(entries) < len(wanted):
+            page = self._getData(
+                "tailf-ncs:devices/device",
+                { "fields": fields, "offset": offset, "limit": page_size }
+            ).get("tailf-ncs:device", [])
+
+            entries.update({entry["name"]: entry for entry in page if entry["name"] in wanted})
+
+            if len(page) < page_size:
+                break
+            offset += page_size
+
+        return entries
+
+    def discoverDevices(
+        self,
+        device_group=None,
+        ned_id="cisco-asa",
+        attributes=None,
+        page_size=500,
+        cache_file=None
+    ):
+        """
+            Discovers devices from NSO's device tree.
+            Only the fields needed for filtering are requested, a page of devices at a time,
+            and pages that haven't changed since the last call are served from the cache.
+            With a device group and no other filters the group's member list is all that's read.
+
+            :param device_group: only devices that are members of this device group
+            :type device_group: str
+            :param ned_id: only devices whose NED ID contains this, None for every NED
+            :type ned_id: str
+            :param attributes: only devices whose fields equal these values, such as { "authgroup": "asa" }
+            :type attributes: dict[str] = str
+            :param page_size: devices fetched per request
+            :type page_size: int
+            :param cache_file: if given, keeps the cache in this file between runs
+            :type cache_file: str
+
+            :return: hostnames of matching devices
+            :rtype: list[str]
+        """
+
+        attributes = attributes if attributes else {}
+        fields = ["name", *attributes]
+        if ned_id:
+            fields.append("device-type/cli/ned-id")
+
+        def matches(entry):
+            if ned_id and ned_id not in str(self._getField(entry, "device-type/cli/ned-id")):
+                return False
+            return all(str(self._getField(entry, field)) == str(value) for field, value in attributes.items())
+
+        if cache_file:
+            self._loadDataCache(cache_file)
+
+        devices = []
+
+        try:
+            if device_group:
+                group = self._getData(
+                    f"tailf-ncs:devices/device-group={quote(device_group, safe='')}",
+                    { "fields": "device-name;member" }
+                )
+                group = group.get("tailf-ncs:device-group", [{}])[0]
+                # device-name is the flattened membership, including devices of nested groups.
+                members = group.get("device-name", group.get("member", []))
+
+                if not ned_id and not attributes:
+                    devices = list(members)
+                else:
+                    entries = self._readDevices(members, ";".join(fields), page_size)
+                    devices = [device for device in members if device in entries and matches(entries[device])]
+            else:
+                offset = 0
+                while True:
+                    page = self._getData(
+                        "tailf-ncs:devices/device",
+                        { "fields": ";".join(fields), "offset": offset, "limit": page_size }
+                    ).get("tailf-ncs:device", [])
+
+                    devices.extend(entry["name"] for entry in page if matches(entry))
+
+                    if len(page) < page_size:
+                        break
+                    offset += page_size
+        except Exception as error:
+            self.logger.error(f"Device discovery failed: {error}")
+            return []
+
+        if cache_file:
+            self._saveDataCache(cache_file)
+
+        self.logger.info(f"Discovered {len(devices)} devices.")
+
+        return devices
+
+    def _parse(self, function, *args, size=0):
+        """
+            Runs a parse function in the parse pool if there is one, otherwise in the calling thread.
+
+            :param function: module-level function doing the parsing
+            :type function: callable
+            :param args: arguments passed to the function
+            :type args: list
+            :param size: bytes of input, used to batch small inputs together
+            :type size: int
+
+            :return: result of the function
+            :rtype: any
+        """
+
+        if self.parse_pool:
+            return self.parse_pool.parse(function, *args, size=size)
+
+        return function(*args)
+
+    def _isReadOnly(self, commands):
+        """
+            Checks if commands only read from a device, so identical calls can share one result.
+
+            :param commands: commands for device separated into a list
+            :type commands: list[str]
+
+            :return: True if every command is read-only
+            :rtype: bool
+        """
+
+        return all(command.split(maxsplit=1)[0].lower() in READ_ONLY_COMMANDS for command in commands if command.strip())
+
+    def _execCommands(self, device, commands, priority=None):
+        """
+            Sends commands to a device through NSO's live-status exec.
+
+            :param device: hostname of device commands are intended for
+            :type device: str
+            :param commands: commands for device separated into a list
+            :type commands: list[str]
+            :param priority: PRIORITY_INTERACTIVE or PRIORITY_BULK, defaults to the calling lane
+            :type priority: int
+
+            :return: response from NSO for device
+            :rtype: requests.Response
+        """
+
+        command_string = '\n'.join(commands)
+        url = f"{self.base_api_url}/device={device}/live-status/tailf-ned-cisco-asa-stats:exec/any"
+        payload = json.dumps({ "input": { "args": command_string }})
+        headers = { "Content-Type": "application/yang-data+json" }
+
+        return self._request(
+            "POST",
+            url=url,
+            priority=priority,
+            headers=headers,
+            data=payload
+        )
+
+    def runCommandsOnDevice(
+        self,
+        device,
+        commands,
+        success_message="",
+        failure_message="",
+        priority=None,
+        parser=None,
+        parser_args=(),
+        coalesce=True
+    ):
         """
             Utilizes NSO REST API to run commands on devices.
+            Identical read-only commands already in flight for the device in the same lane share one call to NSO.
+            Reads that must see a change just made, such as verifying it, pass coalesce=False.
+            With a parser the device output is parsed where NSO's response is decoded,
+            in the parse pool when one is configured.
 
             :param device: hostname of device commands are intended for
             :type device: str
@@ -112,49 +1489,53 @@ class NSOWrangler:
             :type success_message: str
             :param failure_message: specific output from device that denotes failure
             :type failure_message: str
+            :param priority: PRIORITY_INTERACTIVE or PRIORITY_BULK, defaults to the calling lane
+            :type priority: int
+            :param parser: function turning the device output into a result, module-level so a parse worker process can import it
+            :type parser: callable
+            :param parser_args: arguments passed to the parser after the output
+            :type parser_args: tuple
+            :param coalesce: if False never shares a call already in flight, which may have started before a change
+            :type coalesce: bool
 
-            :return: response from NSO for device
+            :return: response from NSO for device, or the parsed result with a parser
             :rtype: str
         """
         
         self.logger.info(f"{device}:\tPerforming the following commands: {commands}.")
 
-        command_string = '\n'.join(commands)
-        url = f"{self.base_api_url}/device={device}/live-status/tailf-ned-cisco-asa-stats:exec/any"
-        payload = json.dumps({ "input": { "args": command_string }})
-        headers = { "Content-Type": "application/yang-data+json" }
-
         try:
-            response = requests.request(
-                "POST",
-                url=url,
-                auth=(self.username, self.password),
-                headers=headers,
-                data=payload,
-                verify=False
-            )
+            if coalesce and self._isReadOnly(commands):
+                # Calls only coalesce within a lane, so an interactive caller never waits on a queued bulk call.
+                if priority is None:
+                    priority = getattr(self._lane, "priority", PRIORITY_INTERACTIVE)
+                key = (self.username, device, tuple(commands), priority)
+                response = self.flights.do(key, self._execCommands, device, commands, priority)
+            else:
+                response = self._execCommands(device, commands, priority)
         except Exception as error:
             self.logger.error(f"{device}:\t{error}")
             return False       
 
         try:
-            device_data = json.loads(response.text)
+            errors, output = self._parse(
+                decodeExecResponse,
+                response.content,
+                parser,
+                tuple(parser_args),
+                failure_message,
+                size=len(response.content)
+            )
 
-            if "errors" in device_data:
-                self.logger.error(f"{device}:\t{device_data['errors']}")
+            if errors:
+                self.logger.error(f"{device}:\t{errors}")
                 if self.console:
-                  print(f"{device}: {device_data['errors']}\n")
+                  print(f"{device}: {errors}\n")
                 return False
-            
-            output = device_data["tailf-ned-cisco-asa-stats:output"]["result"]
+
             if self.console:
                 print(f"{device}: {output}\n")
 
-            if failure_message and failure_message in output:
-                return False
-            if success_message and success_message in output:
-                return output
-
             return output
 
         except Exception as error:
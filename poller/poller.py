@@ -28,13 +28,37 @@ sys.path.append('..')
 from nso_wrangler import NSOWrangler
 
 
+def parseSessionData(response):
+    """
+        Parses VPN session data from the output of "show vpn-sessiondb".
+
+        :param response: output of the device
+        :type response: str
+
+        :return: VPN session data - active, cumulative, and peak, None if there's no session data
+        :rtype: dict[str] = int
+    """
+
+    if "AnyConnect Client" not in response:
+        return None
+
+    session_stats = re.findall(r'\d+', response)
+
+    return {
+        'active': int(session_stats[0]),
+        'cumulative': int(session_stats[1]),
+        'peak': int(session_stats[2])
+    }
+
+
 class Poller(NSOWrangler):
     def __init__(
         self,
         nso_server,
         nso_port,
         username,
-        password
+        password,
+        **kwargs
     ):
         """
             Pulls VPN session data from devices and can boot sessions.
@@ -48,6 +72,8 @@ class Poller(NSOWrangler):
             :type username: str
             :param password: login password for NSO server
             :type password: str
+            :param kwargs: connection options passed through to NSOWrangler
+            :type kwargs: dict
         """
 
         super().__init__(
@@ -55,7 +81,8 @@ class Poller(NSOWrangler):
             nso_port=nso_port,
             username=username,
             password=password,
-            console=False
+            console=False,
+            **kwargs
         )
 
         self.logger.info("Initializing Poller")
@@ -71,12 +98,7 @@ class Poller(NSOWrangler):
             :rtype: dict[str] = dict
         """
 
-        results = {}
-
-        for device in devices:
-            results[device] = self.pullDeviceSessionData(device)
-
-        return results
+        return self._mapDevices(self.pullDeviceSessionData, devices)
 
     def pullDeviceSessionData(self, device):
         """
@@ -96,20 +118,15 @@ class Poller(NSOWrangler):
             'peak': 0 
         }
 
-        response = self.runCommandsOnDevice(device, ["show vpn-sessiondb"])
+        response = self.runCommandsOnDevice(device, ["show vpn-sessiondb"], parser=parseSessionData)
 
         if response is False:
             return sessions
-        elif "AnyConnect Client" not in response:
+        elif response is None:
             self.logger.info(f"{device}:\tNo session data.")
             return sessions
 
-        session_stats = re.findall(r'\d+', response)
-        sessions['active'] = int(session_stats[0])
-        sessions['cumulative'] = int(session_stats[1])
-        sessions['peak'] = int(session_stats[2])
-
-        return sessions
+        return response
 
     def clearAllDeviceSessionData(self, devices):
         """
@@ -122,12 +139,7 @@ class Poller(NSOWrangler):
             :rtype: dict[str] = bool
         """
 
-        results = {}
-
-        for device in devices:
-            results[device] = self.clearDeviceSessionData(device)
-
-        return results
+        return self._mapDevices(self.clearDeviceSessionData, devices, max_workers=1)
 
     def clearDeviceSessionData(self, device):
         """
@@ -167,7 +179,7 @@ class Poller(NSOWrangler):
 
         self.logger.info(f"{device}:\tLogging {user} off of {device}.")
 
-        self.runCommandsOnDevice(device, f"vpn-sessiondb logoff name {user} noconfirm")
+        response = self.runCommandsOnDevice(device, [f"vpn-sessiondb logoff name {user} noconfirm"])
 
         if response is False:
             return False
@@ -191,12 +203,7 @@ class Poller(NSOWrangler):
             :rtype: dict[str] = bool
         """
 
-        results = {}
-
-        for device in devices:
-            results[device] = self.logoffAllusers(device)
-
-        return results
+        return self._mapDevices(self.logoffAllUsers, devices, max_workers=1)
 
     def logoffAllUsers(self, device):
         """
@@ -211,7 +218,7 @@ class Poller(NSOWrangler):
 
         self.logger.info(f"{device}:\tLogging all users off of {device}.")
         
-        self.runCommandsOnDevice(device, f"vpn-sessiondb logoff all noconfirm")
+        response = self.runCommandsOnDevice(device, ["vpn-sessiondb logoff all noconfirm"])
 
         if response is False:
             return False
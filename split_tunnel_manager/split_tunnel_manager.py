@@ -21,6 +21,7 @@ __license__ = "Cisco Sample Code License, Version 1.1"
 
 import logging
 from logging.handlers import RotatingFileHandler
+import json
 import re
 import sys
 sys.path.append('..')
@@ -28,13 +29,48 @@ sys.path.append('..')
 from nso_wrangler import NSOWrangler
 
 
+def parsePolicyConfig(response, group_policy, split_policy):
+    """
+        Parses FQDN split tunneling configuration from the output of "show run".
+
+        :param response: output of the device
+        :type response: str
+        :param group_policy: group policy where FQDN split tunneling is being applied
+        :type group_policy: str
+        :param split_policy: "include" or "exclude"
+        :type split_policy: str
+
+        :return: exclude or include FQDN split tunneling configuration found on the device
+        :rtype: dict[str] = bool/list
+    """
+
+    checks = {
+        'webvpn': False,
+        'group_policy': False,
+        'domains': [],
+        'domains_missing': [],
+        'domains_extra': [],
+    }
+
+    for line in response.split('\r\n'):
+        if f"anyconnect-custom-attr dynamic-split-{split_policy}-domains" in line:
+            checks['webvpn'] = True
+        if f"anyconnect-custom dynamic-split-{split_policy}-domains value {group_policy.lower()}_{split_policy}" in line:
+            checks['group_policy'] = True
+        if f"anyconnect-custom-data dynamic-split-{split_policy}-domains {group_policy.lower()}_{split_policy}" in line:
+            checks['domains'] += re.findall(r"([^\s,]+)(?=,)", line)
+
+    return checks
+
+
 class SplitTunnelManager(NSOWrangler):
     def __init__(
         self,
         nso_server,
         nso_port,
         username,
-        password
+        password,
+        **kwargs
     ):
         """
             Audits, manages, and clears FQDN split tunneling on ASAs.
@@ -48,6 +84,8 @@ class SplitTunnelManager(NSOWrangler):
             :type username: str
             :param password: login password for NSO server
             :type password: str
+            :param kwargs: connection options passed through to NSOWrangler
+            :type kwargs: dict
         """
 
         super().__init__(
@@ -55,7 +93,8 @@ class SplitTunnelManager(NSOWrangler):
             nso_port=nso_port,
             username=username,
             password=password,
-            console=False
+            console=False,
+            **kwargs
         )
 
         self.logger.info("Initializing Split Tunnel Manager")
@@ -67,6 +106,12 @@ class SplitTunnelManager(NSOWrangler):
             Logs are contained within the file "./logs/poller-debug.log".
         """
 
+        logger = logging.getLogger(__name__)
+
+        # Every client in a process shares the logger, only the first one sets it up.
+        if logger.handlers:
+            return logger
+
         logger_file_handler = RotatingFileHandler(filename="./logs/poller-debug.log", maxBytes=2000000, backupCount=5)
         logger_file_handler.setLevel(logging.DEBUG)
         
@@ -75,7 +120,6 @@ class SplitTunnelManager(NSOWrangler):
 
         logging.captureWarnings(True)
 
-        logger = logging.getLogger(__name__)
         warnings_logger = logging.getLogger("py.warnings")
 
         logger.addHandler(logger_file_handler)
@@ -84,7 +128,7 @@ class SplitTunnelManager(NSOWrangler):
 
         return logger
 
-    def auditDevices(self, devices, group_policy, exclude_domains, include_domains):
+    def auditDevices(self, devices, group_policy, exclude_domains, include_domains, journal=None, resume=False):
         """
             Master function to audit FQDN split tunneling for multiple devices.
 
@@ -96,19 +140,26 @@ class SplitTunnelManager(NSOWrangler):
             :type exclude_domains: list[str]
             :param include_domains: domains that should not be split tunneled (include)
             :type include_domains: list[str]
+            :param journal: checkpoint journal or its filename
+            :type journal: SweepJournal or str
+            :param resume: if True only works on devices the journal doesn't have as succeeded
+            :type resume: bool
 
             :return: FQDN split tunneling data for each device
             :rtype: dict[str] = dict
         """
 
-        results = {}
-
-        for device in devices:
-            results[device] = self.auditDevice(device, group_policy, exclude_domains, include_domains)
-
-        return results
+        return self._mapDevices(
+            self.auditDevice,
+            devices,
+            group_policy,
+            exclude_domains,
+            include_domains,
+            journal=journal,
+            resume=resume
+        )
 
-    def auditDevice(self, device, group_policy, exclude_domains, include_domains):
+    def auditDevice(self, device, group_policy, exclude_domains, include_domains, coalesce=True):
         """
             Audits FQDN split tunneling for a device by looking at what's being excluded/included.
 
@@ -120,8 +171,10 @@ class SplitTunnelManager(NSOWrangler):
             :type exclude_domains: list[str]
             :param include_domains: domains that should not be split tunneled (include)
             :type include_domains: list[str]
+            :param coalesce: if False never shares a read already in flight for the device
+            :type coalesce: bool
 
-            :return: FQDN split tunneling data for a device
+            :return: FQDN split tunneling data for a device, False for a policy that couldn't be read
             :rtype: dict[str] = dict
         """
 
@@ -129,15 +182,15 @@ class SplitTunnelManager(NSOWrangler):
 
         if exclude_domains:
             self.logger.info(f"{device}:\tAuditting exclude domains")
-            results['exclude'] = self.auditPolicyConfig(device, group_policy, exclude_domains, "exclude")
+            results['exclude'] = self.auditPolicyConfig(device, group_policy, exclude_domains, "exclude", coalesce)
 
         if include_domains:
             self.logger.info(f"{device}:\tAuditting include domains")
-            results['include'] = self.auditPolicyConfig(device, group_policy, include_domains, "include")
+            results['include'] = self.auditPolicyConfig(device, group_policy, include_domains, "include", coalesce)
 
         return results
 
-    def auditPolicyConfig(self, device, group_policy, domains, split_policy):
+    def auditPolicyConfig(self, device, group_policy, domains, split_policy, coalesce=True):
         """
             Audits FQDN split tunneling for a device.
 
@@ -149,31 +202,39 @@ class SplitTunnelManager(NSOWrangler):
             :type domains: list[str]
             :param split_policy: "include" or "exclude"
             :type split_policy: str
+            :param coalesce: if False never shares a read already in flight for the device
+            :type coalesce: bool
 
-            :return: exclude or include FQDN split tunneling data for a device
+            :return: exclude or include FQDN split tunneling data for a device, False if the configuration couldn't be read
             :rtype: dict[str] = bool/list
         """
 
-        checks = {
-            'webvpn': False,
-            'group_policy': False,
-            'domains': [],
-            'domains_missing': [],
-            'domains_extra': [],
-        }
-
-        response = self.runCommandsOnDevice(device, [f"show run | include dynamic-split-{split_policy}-domains"])
+        response = self.runCommandsOnDevice(
+            device,
+            [f"show run | include dynamic-split-{split_policy}-domains"],
+            parser=parsePolicyConfig,
+            parser_args=(group_policy, split_policy),
+            coalesce=coalesce
+        )
 
         if response is False:
-            return checks
+            self.logger.error(f"{device}:\tCould not read {split_policy} configuration")
+            return False
 
-        for line in response.split('\r\n'):
-            if f"anyconnect-custom-attr dynamic-split-{split_policy}-domains" in line:
-                checks['webvpn'] = True
-            if f"anyconnect-custom dynamic-split-{split_policy}-domains value {group_policy.lower()}_{split_policy}" in line:
-                checks['group_policy'] = True
-            if f"anyconnect-custom-data dynamic-split-{split_policy}-domains {group_policy.lower()}_{split_policy}" in line:
-                checks['domains'] += re.findall(r"([^\s,]+)(?=,)", line)
+        return self._compareDomains(response, domains)
+
+    def _compareDomains(self, checks, domains):
+        """
+            Compares the domains found on a device against the domains it should have.
+
+            :param checks: audit of a device with the domains found
+            :type checks: dict[str] = bool/list
+            :param domains: domains that should be in configuration
+            :type domains: list[str]
+
+            :return: audit of a device with missing and extra domains filled in
+            :rtype: dict[str] = bool/list
+        """
 
         device_domains = set(checks['domains'])
         audit_domains = set(domains)
@@ -190,11 +251,22 @@ class SplitTunnelManager(NSOWrangler):
 
         return checks
 
-    def updateDevices(self, devices, group_policy, exclude_domains, include_domains):
+    def auditDevicesFromCDB(
+        self,
+        devices,
+        group_policy,
+        exclude_domains,
+        include_domains,
+        check_sync=True,
+        batch_size=500
+    ):
         """
-            Master function to update FQDN split tunneling for multiple devices.
+            Master function to audit FQDN split tunneling from NSO's copy of the device configuration.
+            Reads only the split tunneling configuration, a page of devices per request,
+            instead of running "show run" on each device. Devices NSO reports as out of sync,
+            or doesn't have configuration for, fall back to a live audit.
 
-            :param devices: devices commands are intended for
+            :param devices: devices being audited
             :type devices: list[str]
             :param group_policy: group policy where FQDN split tunneling is being applied
             :type group_policy: str
@@ -202,17 +274,222 @@ class SplitTunnelManager(NSOWrangler):
             :type exclude_domains: list[str]
             :param include_domains: domains that should not be split tunneled (include)
             :type include_domains: list[str]
+            :param check_sync: if True checks with NSO that its configuration matches the devices
+            :type check_sync: bool
+            :param batch_size: devices checked for sync, or read, per request
+            :type batch_size: int
 
-            :return: success of updating FQDN split tunneling data for each device
+            :return: FQDN split tunneling data for each device
             :rtype: dict[str] = dict
         """
 
         results = {}
+        remaining = set(devices)
+
+        in_sync = self._checkSync(devices, batch_size) if check_sync else remaining
+        fields = ";".join([
+            "name",
+            "config/tailf-ned-cisco-asa:webvpn/anyconnect-custom-attr",
+            "config/tailf-ned-cisco-asa:anyconnect-custom-data",
+            "config/tailf-ned-cisco-asa:group-policy(name;attributes/anyconnect-custom)",
+        ])
+
+        try:
+            entries = self._readDevices([device for device in devices if device in in_sync], fields, batch_size)
+        except Exception as error:
+            self.logger.error(f"Reading configuration from NSO failed: {error}")
+            entries = {}
+
+        for device, entry in entries.items():
+            config = entry.get("config", entry.get("tailf-ncs:config", {}))
+            results[device] = {}
+            if exclude_domains:
+                results[device]['exclude'] = self._auditCDBConfig(config, group_policy, exclude_domains, "exclude")
+            if include_domains:
+                results[device]['include'] = self._auditCDBConfig(config, group_policy, include_domains, "include")
+            remaining.discard(device)
+
+        if remaining:
+            self.logger.info(f"Auditing {len(remaining)} devices live.")
+            results.update(self.auditDevices(
+                [device for device in devices if device in remaining],
+                group_policy,
+                exclude_domains,
+                include_domains
+            ))
+
+        return {device: results[device] for device in devices}
+
+    def _checkSync(self, devices, batch_size):
+        """
+            Asks NSO which devices still match its copy of their configuration,
+            checking a batch of devices per request.
 
-        for device in devices:
-            results[device] = self.updateDevice(device, group_policy, exclude_domains, include_domains)
+            :param devices: devices being checked
+            :type devices: list[str]
+            :param batch_size: devices checked per request
+            :type batch_size: int
 
-        return results
+            :return: devices that are in sync
+            :rtype: set[str]
+        """
+
+        in_sync = set()
+        headers = { "Content-Type": "application/yang-data+json" }
+
+        for start in range(0, len(devices), batch_size):
+            batch = devices[start:start + batch_size]
+            payload = json.dumps({ "input": { "device": batch }})
+
+            try:
+                response = self._request("POST", url=f"{self.base_api_url}/check-sync", headers=headers, data=payload)
+                sync_results = json.loads(response.text)["tailf-ncs:output"]["sync-result"]
+            except Exception as error:
+                self.logger.error(f"Check-sync failed: {error}")
+                continue
+
+            for sync_result in sync_results:
+                if sync_result.get("result") == "in-sync":
+                    in_sync.add(sync_result["device"])
+                else:
+                    self.logger.info(f"{sync_result['device']}:\tNSO reports {sync_result.get('result')}.")
+
+        return in_sync
+
+    def _auditCDBConfig(self, config, group_policy, domains, split_policy):
+        """
+            Audits FQDN split tunneling from NSO's copy of a device's configuration.
+
+            :param config: split tunneling configuration of the device from NSO
+            :type config: dict
+            :param group_policy: group policy where FQDN split tunneling is being applied
+            :type group_policy: str
+            :param domains: domains that should be in configuration
+            :type domains: list[str]
+            :param split_policy: "include" or "exclude"
+            :type split_policy: str
+
+            :return: exclude or include FQDN split tunneling data for a device
+            :rtype: dict[str] = bool/list
+        """
+
+        checks = {
+            'webvpn': False,
+            'group_policy': False,
+            'domains': [],
+            'domains_missing': [],
+            'domains_extra': [],
+        }
+
+        attribute = f"dynamic-split-{split_policy}-domains"
+        data_name = f"{group_policy.lower()}_{split_policy}"
+
+        webvpn = config.get("tailf-ned-cisco-asa:webvpn", {})
+        for entry in webvpn.get("anyconnect-custom-attr", []):
+            if attribute in entry.values():
+                checks['webvpn'] = True
+
+        for policy in config.get("tailf-ned-cisco-asa:group-policy", []):
+            if policy.get("name") != group_policy:
+                continue
+            for entry in policy.get("attributes", {}).get("anyconnect-custom", []):
+                if attribute in entry.values() and data_name in entry.values():
+                    checks['group_policy'] = True
+
+        for entry in config.get("tailf-ned-cisco-asa:anyconnect-custom-data", []):
+            if attribute in entry.values() and data_name in entry.values():
+                values = entry.get("value", [])
+                for value in values if isinstance(values, list) else [values]:
+                    checks['domains'] += [domain.strip() for domain in value.split(",") if domain.strip()]
+
+        return self._compareDomains(checks, domains)
+
+    def updateDevices(
+        self,
+        devices,
+        group_policy,
+        exclude_domains,
+        include_domains,
+        journal=None,
+        resume=False,
+        waves=None,
+        failure_threshold=0.1,
+        verify=False
+    ):
+        """
+            Master function to update FQDN split tunneling for multiple devices.
+            Updates one device at a time, or in waves of growing size that
+            halt when too many devices of a wave fail.
+
+            :param devices: devices commands are intended for
+            :type devices: list[str]
+            :param group_policy: group policy where FQDN split tunneling is being applied
+            :type group_policy: str
+            :param exclude_domains: domains that should be split tunneled (exclude)
+            :type exclude_domains: list[str]
+            :param include_domains: domains that should not be split tunneled (include)
+            :type include_domains: list[str]
+            :param journal: checkpoint journal or its filename
+            :type journal: SweepJournal or str
+            :param resume: if True only works on devices the journal doesn't have as succeeded
+            :type resume: bool
+            :param waves: sizes of the rollout waves before the rest of the devices, such as (1, 5, 25)
+            :type waves: list[int]
+            :param failure_threshold: share of failed devices in a wave that halts the rollout
+            :type failure_threshold: float
+            :param verify: if True audits every updated device after its wave
+            :type verify: bool
+
+            :return: success of updating FQDN split tunneling data for each device, None if not reached
+            :rtype: dict[str] = dict
+        """
+
+        if waves:
+            return self._rolloutDevices(
+                self.updateDevice,
+                devices,
+                group_policy,
+                exclude_domains,
+                include_domains,
+                waves=waves,
+                failure_threshold=failure_threshold,
+                verify=(lambda device: self._verifyUpdate(device, group_policy, exclude_domains, include_domains)) if verify else None,
+                journal=journal,
+                resume=resume
+            )
+
+        return self._mapDevices(
+            self.updateDevice,
+            devices,
+            group_policy,
+            exclude_domains,
+            include_domains,
+            max_workers=1,
+            journal=journal,
+            resume=resume
+        )
+
+    def _verifyUpdate(self, device, group_policy, exclude_domains, include_domains):
+        """
+            Audits a device after an update to confirm every domain is in place.
+
+            :param device: device being verified
+            :type device: str
+            :param group_policy: group policy where FQDN split tunneling is being applied
+            :type group_policy: str
+            :param exclude_domains: domains that should be split tunneled (exclude)
+            :type exclude_domains: list[str]
+            :param include_domains: domains that should not be split tunneled (include)
+            :type include_domains: list[str]
+
+            :return: True if the device has the update
+            :rtype: bool
+        """
+
+        # A coalesced read could have started before the update and miss it.
+        audit = self.auditDevice(device, group_policy, exclude_domains, include_domains, coalesce=False)
+
+        return all(checks and checks['group_policy'] and not checks['domains_missing'] for checks in audit.values())
 
     def updateDevice(self, device, group_policy, exclude_domains, include_domains):
         """
@@ -293,25 +570,80 @@ class SplitTunnelManager(NSOWrangler):
 
         return True if response else False
 
-    def clearDevices(self, devices, group_policy):
+    def clearDevices(
+        self,
+        devices,
+        group_policy,
+        journal=None,
+        resume=False,
+        waves=None,
+        failure_threshold=0.1,
+        verify=False
+    ):
         """
             Master function to clear FQDN split tunneling for multiple devices.
+            Clears one device at a time, or in waves of growing size that
+            halt when too many devices of a wave fail.
 
             :param devices: devices commands are intended for
             :type devices: list[str]
             :param group_policy: group policy where FQDN split tunneling is being applied
             :type group_policy: str
-
-            :return: success of clearing FQDN split tunneling data for each device
+            :param journal: checkpoint journal or its filename
+            :type journal: SweepJournal or str
+            :param resume: if True only works on devices the journal doesn't have as succeeded
+            :type resume: bool
+            :param waves: sizes of the rollout waves before the rest of the devices, such as (1, 5, 25)
+            :type waves: list[int]
+            :param failure_threshold: share of failed devices in a wave that halts the rollout
+            :type failure_threshold: float
+            :param verify: if True audits every cleared device after its wave
+            :type verify: bool
+
+            :return: success of clearing FQDN split tunneling data for each device, None if not reached
             :rtype: dict[str] = dict
         """
 
-        results = {}
+        if waves:
+            return self._rolloutDevices(
+                self.clearDevice,
+                devices,
+                group_policy,
+                waves=waves,
+                failure_threshold=failure_threshold,
+                verify=(lambda device: self._verifyClear(device, group_policy)) if verify else None,
+                journal=journal,
+                resume=resume
+            )
+
+        return self._mapDevices(
+            self.clearDevice,
+            devices,
+            group_policy,
+            max_workers=1,
+            journal=journal,
+            resume=resume
+        )
 
-        for device in devices:
-            results[device] = self.clearDevice(device, group_policy)
+    def _verifyClear(self, device, group_policy):
+        """
+            Audits a device after a clear to confirm no FQDN split tunneling is left.
 
-        return results
+            :param device: device being verified
+            :type device: str
+            :param group_policy: group policy where FQDN split tunneling is being applied
+            :type group_policy: str
+
+            :return: True if the device was cleared, False if it wasn't or couldn't be read
+            :rtype: bool
+        """
+
+        for split_policy in ("exclude", "include"):
+            checks = self.auditPolicyConfig(device, group_policy, [], split_policy, coalesce=False)
+            if not checks or checks['group_policy'] or checks['domains']:
+                return False
+
+        return True
 
     def clearDevice(self, device, group_policy):
         """
@@ -403,6 +735,10 @@ if __name__ == "__main__":
                     for policy in data[device]:
                         writer.writerow(['', policy])
 
+                        if not data[device][policy]:
+                            writer.writerow(['', '', 'error'])
+                            continue
+
                         domains_missing = data[device][policy]['domains_missing'] if data[device][policy]['domains_missing'] else ['N/A']
                         domains_extra = data[device][policy]['domains_extra'] if data[device][policy]['domains_extra'] else ['N/A']
 